@@ -208,6 +208,9 @@ class CoordinateCalculatorAlgorithm(QgsProcessingAlgorithm):
                 total_features = layer.featureCount()
                 layer.startEditing()
 
+                # Resolve field indices once instead of by name for every feature
+                field_indices = {field_name: layer.fields().lookupField(field_name) for field_name in fields_to_add}
+
                 # Process features in batches
                 batch_size = 500
                 for i in range(0, total_features, batch_size):
@@ -252,7 +255,7 @@ class CoordinateCalculatorAlgorithm(QgsProcessingAlgorithm):
                         # Prepare attribute map for the feature
                         feature_attr_map = {}
                         for field_name, value in attrs.items():
-                            field_index = layer.fields().lookupField(field_name)
+                            field_index = field_indices[field_name]
                             if field_index != -1:
                                 feature_attr_map[field_index] = value
                         
@@ -278,6 +281,9 @@ class CoordinateCalculatorAlgorithm(QgsProcessingAlgorithm):
                 if sink is None:
                     raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
                 
+                # Resolve field indices once instead of by name for every feature
+                field_indices = {field_name: output_fields.indexOf(field_name) for field_name in fields_to_add}
+
                 # Process features
                 total_features = source.featureCount()
                 for current, feature in enumerate(source.getFeatures()):
@@ -306,17 +312,17 @@ class CoordinateCalculatorAlgorithm(QgsProcessingAlgorithm):
                     
                     # Add new attributes
                     if calculate_xy:
-                        new_feature.setAttribute('X', round(point_in_crs.x(), precision))
-                        new_feature.setAttribute('Y', round(point_in_crs.y(), precision))
+                        new_feature.setAttribute(field_indices['X'], round(point_in_crs.x(), precision))
+                        new_feature.setAttribute(field_indices['Y'], round(point_in_crs.y(), precision))
                     if format_dd:
-                        new_feature.setAttribute('DD_Lat', round(point_wgs84.y(), precision))
-                        new_feature.setAttribute('DD_Lon', round(point_wgs84.x(), precision))
+                        new_feature.setAttribute(field_indices['DD_Lat'], round(point_wgs84.y(), precision))
+                        new_feature.setAttribute(field_indices['DD_Lon'], round(point_wgs84.x(), precision))
                     if format_dms:
-                        new_feature.setAttribute('DMS_Lat', convert_to_dms(point_wgs84.y(), 'lat'))
-                        new_feature.setAttribute('DMS_Lon', convert_to_dms(point_wgs84.x(), 'lon'))
+                        new_feature.setAttribute(field_indices['DMS_Lat'], convert_to_dms(point_wgs84.y(), 'lat'))
+                        new_feature.setAttribute(field_indices['DMS_Lon'], convert_to_dms(point_wgs84.x(), 'lon'))
                     if format_dms2:
-                        new_feature.setAttribute('Lat_DMS', convert_to_dms2(point_wgs84.y(), 'lat'))
-                        new_feature.setAttribute('Lon_DMS', convert_to_dms2(point_wgs84.x(), 'lon'))
+                        new_feature.setAttribute(field_indices['Lat_DMS'], convert_to_dms2(point_wgs84.y(), 'lat'))
+                        new_feature.setAttribute(field_indices['Lon_DMS'], convert_to_dms2(point_wgs84.x(), 'lon'))
                     
                     sink.addFeature(new_feature, QgsFeatureSink.FastInsert)
                     feedback.setProgress(int((current + 1) / total_features * 100))
@@ -330,7 +336,10 @@ class CoordinateCalculatorAlgorithm(QgsProcessingAlgorithm):
             raise
 
 
-def convert_to_dms(decimal_degree, coord_type):
+_DMS_FMT = "%2d° %02d' %05.2f\" %s"
+_DMS2_FMT = "%s %2d° %02d' %05.2f\""
+
+def _split_dms(decimal_degree, coord_type):
     is_positive = decimal_degree >= 0
     decimal_degree = abs(decimal_degree)
     degrees = int(decimal_degree)
@@ -341,22 +350,16 @@ def convert_to_dms(decimal_degree, coord_type):
     else:
         direction = 'E' if is_positive else 'W'
 
-    return f"{degrees:2d}° {minutes:02d}' {seconds:05.2f}\" {direction}"
+    return degrees, minutes, seconds, direction
 
+def convert_to_dms(decimal_degree, coord_type):
+    return _DMS_FMT % _split_dms(decimal_degree, coord_type)
 
 
-def convert_to_dms2(decimal_degree, coord_type):
-    is_positive = decimal_degree >= 0
-    decimal_degree = abs(decimal_degree)
-    degrees = int(decimal_degree)
-    minutes = int((decimal_degree - degrees) * 60)
-    seconds = round((decimal_degree - degrees - minutes / 60) * 3600, 2)
-    if coord_type == 'lat':
-        direction = 'N' if is_positive else 'S'
-    else:
-        direction = 'E' if is_positive else 'W'
 
-    return f"{direction} {degrees:2d}° {minutes:02d}' {seconds:05.2f}\""
+def convert_to_dms2(decimal_degree, coord_type):
+    degrees, minutes, seconds, direction = _split_dms(decimal_degree, coord_type)
+    return _DMS2_FMT % (direction, degrees, minutes, seconds)
 
 class ArcGeekCalculatorProvider(QgsProcessingProvider):
     def loadAlgorithms(self):
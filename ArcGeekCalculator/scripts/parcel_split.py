@@ -1,12 +1,11 @@
-from qgis.PyQt.QtCore import QCoreApplication
 from qgis.PyQt.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QComboBox, QDialog, QDialogButtonBox
 from qgis.core import (QgsProcessing, QgsFeatureSink, QgsProcessingAlgorithm,
                        QgsProcessingParameterFeatureSource, QgsProcessingParameterNumber,
                        QgsProcessingParameterFeatureSink, QgsFeature, QgsGeometry,
-                       QgsWkbTypes, QgsProcessingException, QgsField, QgsFields,
+                       QgsWkbTypes, QgsProcessingException, QgsField,
                        QgsProcessingParameterEnum)
-import processing
 import math
+from functools import partial
 
 try:
     from shapely.geometry import Polygon, MultiPolygon
@@ -57,6 +56,23 @@ class ParcelSplitAlgorithm(QgsProcessingAlgorithm):
         if sink is None:
             raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
 
+        if split_type == 0:  # By measures
+            width = self.parameterAsDouble(parameters, self.WIDTH, context)
+            length = self.parameterAsDouble(parameters, self.LENGTH, context)
+            if width <= 0 or length <= 0:
+                raise QgsProcessingException("Width and length must be greater than 0 for 'By measures' split type.")
+            split_parcel = partial(self.split_parcel_by_measures, width=width, length=length)
+        elif split_type == 1:  # Equal parts
+            num_parts = self.parameterAsInt(parameters, self.NUM_PARTS, context)
+            if num_parts < 2:
+                raise QgsProcessingException("Number of parts must be at least 2 for 'Equal parts' split type.")
+            split_parcel = partial(self.split_parcel_equal_parts, num_parts=num_parts)
+        else:  # By area
+            target_area = self.parameterAsDouble(parameters, self.TARGET_AREA, context)
+            if target_area <= 0:
+                raise QgsProcessingException("Target area must be greater than 0 for 'By area' split type.")
+            split_parcel = partial(self.split_parcel_by_area, target_area=target_area)
+
         total = 100.0 / source.featureCount() if source.featureCount() else 0
         features = source.getFeatures()
 
@@ -71,22 +87,7 @@ class ParcelSplitAlgorithm(QgsProcessingAlgorithm):
             else:
                 shapely_geom = Polygon([(p.x(), p.y()) for p in geom.asPolygon()[0]])
             
-            if split_type == 0:  # By measures
-                width = self.parameterAsDouble(parameters, self.WIDTH, context)
-                length = self.parameterAsDouble(parameters, self.LENGTH, context)
-                if width <= 0 or length <= 0:
-                    raise QgsProcessingException("Width and length must be greater than 0 for 'By measures' split type.")
-                lots = self.split_parcel_by_measures(shapely_geom, width, length, min_area_ratio, feedback)
-            elif split_type == 1:  # Equal parts
-                num_parts = self.parameterAsInt(parameters, self.NUM_PARTS, context)
-                if num_parts < 2:
-                    raise QgsProcessingException("Number of parts must be at least 2 for 'Equal parts' split type.")
-                lots = self.split_parcel_equal_parts(shapely_geom, num_parts, min_area_ratio, feedback)
-            else:  # By area
-                target_area = self.parameterAsDouble(parameters, self.TARGET_AREA, context)
-                if target_area <= 0:
-                    raise QgsProcessingException("Target area must be greater than 0 for 'By area' split type.")
-                lots = self.split_parcel_by_area(shapely_geom, target_area, min_area_ratio, feedback)
+            lots = split_parcel(shapely_geom, min_area_ratio=min_area_ratio, feedback=feedback)
 
             for i, lot in enumerate(lots):
                 f = QgsFeature()
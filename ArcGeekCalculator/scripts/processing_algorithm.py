@@ -1,9 +1,11 @@
 from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFeatureSource, 
                        QgsProcessingParameterBoolean, QgsProcessingParameterVectorDestination, 
-                       QgsProcessing, QgsProcessingException, QgsField, edit, QgsVectorLayer, 
+                       QgsProcessing, QgsProcessingException, QgsField, edit, 
                        QgsFeatureRequest, QgsVectorFileWriter, QgsCoordinateReferenceSystem,
-                       QgsCoordinateTransform, QgsProject, QgsProcessingProvider)
+                       QgsCoordinateTransform, QgsProcessingProvider, QgsGeometry)
 from qgis.PyQt.QtCore import QVariant
+import numpy as np
+import os
 
 class CoordinateCalculatorAlgorithm(QgsProcessingAlgorithm):
     INPUT = 'INPUT'
@@ -79,17 +81,19 @@ class CoordinateCalculatorAlgorithm(QgsProcessingAlgorithm):
         format_dms = self.parameterAsBool(parameters, self.FORMAT_DMS, context)
         format_dms2 = self.parameterAsBool(parameters, self.FORMAT_DMS2, context)
 
-        if modify_layer:
-            target_layer = self.parameterAsVectorLayer(parameters, self.INPUT, context)
-        else:
-            target_layer = QgsVectorLayer("Point?crs={}".format(source.sourceCrs().authid()), "TemporaryLayer", "memory")
-            target_layer.startEditing()
-            target_layer.dataProvider().addAttributes(source.fields().toList())
-            target_layer.updateFields()
+        if not modify_layer:
+            # Stream the source straight into the output file, computing coordinates on the way
+            output_file = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+            transform = wgs84_transform(source.sourceCrs(), context, format_dd or format_dms or format_dms2)
+            try:
+                write_coordinates(source, output_file, transform, calculate_xy, format_dd, format_dms, format_dms2, feedback)
+            except QgsProcessingException:
+                raise
+            except Exception as e:
+                feedback.reportError("Error calculating coordinates: {}".format(e), fatalError=True)
+            return {self.OUTPUT: output_file}
 
-            for feature in source.getFeatures():
-                target_layer.addFeature(feature)
-            target_layer.commitChanges()
+        target_layer = self.parameterAsVectorLayer(parameters, self.INPUT, context)
 
         if not target_layer.fields():
             raise QgsProcessingException("The layer has no fields.")
@@ -109,16 +113,12 @@ class CoordinateCalculatorAlgorithm(QgsProcessingAlgorithm):
                 target_layer.addAttribute(QgsField('Lat_DMS', QVariant.String))
                 target_layer.addAttribute(QgsField('Lon_DMS', QVariant.String))
 
+        transform = wgs84_transform(target_layer.crs(), context, format_dd or format_dms or format_dms2)
         try:
-            calculate_coordinates(target_layer, calculate_xy, format_dd, format_dms, format_dms2)
+            calculate_coordinates(target_layer, transform, calculate_xy, format_dd, format_dms, format_dms2)
         except Exception as e:
             feedback.reportError("Error calculating coordinates: {}".format(e), fatalError=True)
 
-        if not modify_layer:
-            output_file = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
-            QgsVectorFileWriter.writeAsVectorFormat(target_layer, output_file, "utf-8", target_layer.crs(), "GPKG")
-            return {self.OUTPUT: output_file}
-
         return {self.OUTPUT: target_layer.id()}
 
     def name(self):
@@ -172,59 +172,154 @@ class ArcGeekCalculatorProvider(QgsProcessingProvider):
     def longName(self):
         return self.name()
 
-def calculate_coordinates(layer, calculate_xy, format_dd, format_dms, format_dms2):
-    crs = layer.crs()
-    transform = QgsCoordinateTransform(crs, QgsCoordinateReferenceSystem.fromEpsgId(4326), QgsProject.instance())
-
-    with edit(layer):
-        for feature in layer.getFeatures():
-            try:
-                geom = feature.geometry()
-                if geom.isEmpty():
-                    continue
-
-                point = geom.asPoint()
-                latlon = transform.transform(point)
-
-                if calculate_xy:
-                    feature.setAttribute('X', point.x())
-                    feature.setAttribute('Y', point.y())
-                if format_dd:
-                    feature.setAttribute('DD_Lat', latlon.y())
-                    feature.setAttribute('DD_Lon', latlon.x())
-                if format_dms:
-                    feature.setAttribute('DMS_Lat', convert_to_dms(latlon.y(), 'lat'))
-                    feature.setAttribute('DMS_Lon', convert_to_dms(latlon.x(), 'lon'))
-                if format_dms2:
-                    feature.setAttribute('Lat_DMS', convert_to_dms2(latlon.y(), 'lat'))
-                    feature.setAttribute('Lon_DMS', convert_to_dms2(latlon.x(), 'lon'))
-
-                layer.updateFeature(feature)
-            except Exception as e:
-                raise Exception("Error processing feature {}: {}".format(feature.id(), e))
-
-def convert_to_dms(decimal_degree, coord_type):
-    is_positive = decimal_degree >= 0
-    decimal_degree = abs(decimal_degree)
-    degrees = int(decimal_degree)
-    minutes = int((decimal_degree - degrees) * 60)
-    seconds = round((decimal_degree - degrees - minutes / 60) * 3600, 2)
+def wgs84_transform(crs, context, geographic_fields):
+    # Built once per run with the run's datum settings; None when no transform is needed
+    wgs84 = QgsCoordinateReferenceSystem('EPSG:4326')
+    if not geographic_fields or crs == wgs84:
+        return None
+    return QgsCoordinateTransform(crs, wgs84, context.transformContext())
+
+COORDINATE_FIELDS = {
+    'X': QVariant.Double,
+    'Y': QVariant.Double,
+    'DD_Lat': QVariant.Double,
+    'DD_Lon': QVariant.Double,
+    'DMS_Lat': QVariant.String,
+    'DMS_Lon': QVariant.String,
+    'Lat_DMS': QVariant.String,
+    'Lon_DMS': QVariant.String
+}
+
+def coordinate_columns(points, transform, calculate_xy, format_dd, format_dms, format_dms2):
+    if transform is not None:
+        # Transform all points in a single call instead of one PROJ round-trip per feature
+        try:
+            latlon_geom = QgsGeometry.fromMultiPointXY(points)
+            latlon_geom.transform(transform)
+        except Exception as e:
+            raise Exception("Error transforming coordinates: {}".format(e))
+        latlon = latlon_geom.asMultiPoint()
+    else:
+        latlon = points
+    lats = np.array([p.y() for p in latlon], dtype=np.float64)
+    lons = np.array([p.x() for p in latlon], dtype=np.float64)
+
+    columns = []
+    if calculate_xy:
+        columns.append(('X', [p.x() for p in points]))
+        columns.append(('Y', [p.y() for p in points]))
+    if format_dd:
+        columns.append(('DD_Lat', lats.tolist()))
+        columns.append(('DD_Lon', lons.tolist()))
+    if format_dms:
+        columns.append(('DMS_Lat', convert_to_dms_array(lats, 'lat')))
+        columns.append(('DMS_Lon', convert_to_dms_array(lons, 'lon')))
+    if format_dms2:
+        columns.append(('Lat_DMS', convert_to_dms2_array(lats, 'lat')))
+        columns.append(('Lon_DMS', convert_to_dms2_array(lons, 'lon')))
+    return columns
+
+def calculate_coordinates(layer, transform, calculate_xy, format_dd, format_dms, format_dms2):
+    fids = []
+    points = []
+    # Only geometry and feature id are needed here, so skip fetching attributes
+    for feature in layer.getFeatures(QgsFeatureRequest().setSubsetOfAttributes([])):
+        geom = feature.geometry()
+        if geom.isEmpty():
+            continue
+        fids.append(feature.id())
+        points.append(geom.asPoint())
+    if not fids:
+        return
+
+    fields = layer.dataProvider().fields()
+    columns = [(fields.indexOf(field_name), values)
+               for field_name, values in coordinate_columns(points, transform, calculate_xy, format_dd, format_dms, format_dms2)]
+    columns = [(index, values) for index, values in columns if index != -1]
+
+    # Write every feature's attributes with one provider call instead of updateFeature per feature
+    changes = {fid: {index: values[i] for index, values in columns} for i, fid in enumerate(fids)}
+    if not layer.dataProvider().changeAttributeValues(changes):
+        raise Exception("Error writing coordinate attributes to layer {}".format(layer.name()))
+
+def write_coordinates(source, output_file, transform, calculate_xy, format_dd, format_dms, format_dms2, feedback, batch_size=1000):
+    fields = source.fields()
+    requested = [(calculate_xy, ('X', 'Y')), (format_dd, ('DD_Lat', 'DD_Lon')),
+                 (format_dms, ('DMS_Lat', 'DMS_Lon')), (format_dms2, ('Lat_DMS', 'Lon_DMS'))]
+    for enabled, field_names in requested:
+        for field_name in field_names:
+            if enabled and fields.lookupField(field_name) == -1:
+                fields.append(QgsField(field_name, COORDINATE_FIELDS[field_name]))
+
+    writer = QgsVectorFileWriter(output_file, 'UTF-8', fields, source.wkbType(), source.sourceCrs(), 'GPKG')
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise QgsProcessingException("Error creating output file {}: {}".format(output_file, writer.errorMessage()))
+
+    def write_batch(batch):
+        located = [i for i, feature in enumerate(batch) if not feature.geometry().isEmpty()]
+        points = [batch[i].geometry().asPoint() for i in located]
+        columns = []
+        if points:
+            columns = [(fields.indexOf(field_name), values)
+                       for field_name, values in coordinate_columns(points, transform, calculate_xy, format_dd, format_dms, format_dms2)]
+
+        attributes = []
+        for feature in batch:
+            feature_attributes = feature.attributes()
+            feature_attributes.extend([None] * (fields.count() - len(feature_attributes)))
+            attributes.append(feature_attributes)
+        for j, i in enumerate(located):
+            for index, values in columns:
+                attributes[i][index] = values[j]
+
+        for feature, feature_attributes in zip(batch, attributes):
+            feature.setFields(fields, False)
+            feature.setAttributes(feature_attributes)
+        if not writer.addFeatures(batch):
+            raise QgsProcessingException("Error writing to output file {}: {}".format(output_file, writer.errorMessage()))
+
+    # featureCount() is -1 when the provider does not know it; progress then stays at 0
+    feature_count = source.featureCount()
+    total = 100.0 / feature_count if feature_count > 0 else 0
+    completed = False
+    try:
+        batch = []
+        for current, feature in enumerate(source.getFeatures()):
+            if feedback.isCanceled():
+                break
+            batch.append(feature)
+            if len(batch) >= batch_size:
+                write_batch(batch)
+                batch = []
+                feedback.setProgress(min(100, int((current + 1) * total)))
+        if batch and not feedback.isCanceled():
+            write_batch(batch)
+        completed = not feedback.isCanceled()
+    finally:
+        # Close the file first, then drop it if the run was cancelled or failed part way
+        del writer
+        if not completed and os.path.exists(output_file):
+            os.remove(output_file)
+
+_DMS_FMT = "%2d° %02d' %05.2f\" %s"
+_DMS2_FMT = "%s %2d° %02d' %05.2f\""
+
+def _dms_components(values, coord_type):
+    values = np.asarray(values, dtype=np.float64)
+    abs_values = np.abs(values)
+    degrees = abs_values.astype(np.int64)
+    minutes = ((abs_values - degrees) * 60).astype(np.int64)
+    seconds = np.round((abs_values - degrees - minutes / 60) * 3600, 2)
     if coord_type == 'lat':
-        direction = 'N' if is_positive else 'S'
+        directions = np.where(values >= 0, 'N', 'S')
     else:
-        direction = 'E' if is_positive else 'W'
+        directions = np.where(values >= 0, 'E', 'W')
 
-    return f"{degrees:2d}° {minutes:02d}' {seconds:05.2f}\" {direction}"
+    return zip(degrees.tolist(), minutes.tolist(), seconds.tolist(), directions.tolist())
 
-def convert_to_dms2(decimal_degree, coord_type):
-    is_positive = decimal_degree >= 0
-    decimal_degree = abs(decimal_degree)
-    degrees = int(decimal_degree)
-    minutes = int((decimal_degree - degrees) * 60)
-    seconds = round((decimal_degree - degrees - minutes / 60) * 3600, 2)
-    if coord_type == 'lat':
-        direction = 'N' if is_positive else 'S'
-    else:
-        direction = 'E' if is_positive else 'W'
+def convert_to_dms_array(values, coord_type):
+    return [_DMS_FMT % components for components in _dms_components(values, coord_type)]
 
-    return f"{direction} {degrees:2d}° {minutes:02d}' {seconds:05.2f}\""
\ No newline at end of file
+def convert_to_dms2_array(values, coord_type):
+    return [_DMS2_FMT % (direction, degrees, minutes, seconds)
+            for degrees, minutes, seconds, direction in _dms_components(values, coord_type)]
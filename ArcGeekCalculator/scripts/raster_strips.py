@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import os
+
+def strip_worker_count():
+    # A few worker threads are enough to overlap reading, computing and writing
+    return max(1, min(4, os.cpu_count() or 1))
+
+def process_strips(height, chunk_size, open_worker, outband, feedback):
+    # Compute the output a strip of chunk_size rows at a time, spread over a few worker threads;
+    # GDAL and NumPy release the GIL. GDAL datasets are not thread-safe, so open_worker() is
+    # called once in each thread to open that worker's own handles and returns
+    # compute(y, win_height), which gives the strip's output rows as a 2D array.
+    chunks = [(y, min(chunk_size, height - y)) for y in range(0, height, chunk_size)]
+    num_workers = min(strip_worker_count(), len(chunks))
+    write_lock = threading.Lock()
+    completed = [0]
+
+    def process_chunks(worker_chunks):
+        compute = open_worker()
+        for y, win_height in worker_chunks:
+            if feedback.isCanceled():
+                break
+            result = compute(y, win_height)
+            with write_lock:
+                outband.WriteArray(result, 0, y)
+                completed[0] += 1
+                feedback.setProgress(int(completed[0] * 100 / len(chunks)))
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(process_chunks, chunks[i::num_workers]) for i in range(num_workers)]
+        for future in futures:
+            future.result()
@@ -4,7 +4,73 @@ from qgis.core import (QgsProcessing, QgsProcessingAlgorithm, QgsProcessingParam
                        QgsRasterLayer, QgsProcessingException, QgsProcessingOutputString,
                        QgsProcessingContext, QgsRasterBandStats)
 from osgeo import gdal
+import numpy as np
+from xml.sax.saxutils import escape
 import math
+from .raster_strips import process_strips
+
+try:
+    import numexpr as ne
+    NUMEXPR_AVAILABLE = True
+except ImportError:
+    NUMEXPR_AVAILABLE = False
+
+def stack_bands_vrt(sources, width, height):
+    # Pixel-for-pixel stack of same-sized rasters. Unlike gdal.BuildVRT it does not place
+    # the inputs by georeference, so inputs without one work and the size stays width x height.
+    bands = ''.join(f'<VRTRasterBand dataType="Float32" band="{i}"><SimpleSource>'
+                    f'<SourceFilename relativeToVRT="0">{escape(source)}</SourceFilename>'
+                    f'<SourceBand>1</SourceBand>'
+                    f'<SrcRect xOff="0" yOff="0" xSize="{width}" ySize="{height}"/>'
+                    f'<DstRect xOff="0" yOff="0" xSize="{width}" ySize="{height}"/>'
+                    f'</SimpleSource></VRTRasterBand>'
+                    for i, source in enumerate(sources, start=1))
+    return f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">{bands}</VRTDataset>'
+
+_SATELLITE_NAMES = ('Sentinel-2', 'Landsat-7', 'Landsat-8/9')
+_INDEX_NAMES = ('NDVI', 'NDWI', 'NDBI', 'NDMI', 'MSI', 'NBR', 'AVI', 'SAVI')
+
+# Required (band, band) numbers indexed by [satellite][index], in the order of the names above
+_BAND_TABLE = (
+    ((8, 4), (8, 3), (11, 8), (8, 11), (11, 8), (8, 12), (8, 4), (8, 4)),
+    ((4, 3), (4, 2), (5, 4), (4, 5), (5, 4), (4, 7), (4, 3), (4, 3)),
+    ((5, 4), (5, 3), (6, 5), (5, 6), (6, 5), (5, 7), (5, 4), (5, 4))
+)
+
+def calculate_index(index_name, a_data, b_data):
+    # Works in place on the float32 read buffers, so a_data and b_data are overwritten
+    if index_name in ['NDVI', 'NDWI', 'NDBI', 'NDMI', 'NBR']:
+        result = a_data - b_data
+        a_data += b_data
+        a_data += np.float32(1e-10)  # Add small number to avoid division by zero
+        result /= a_data
+    elif index_name == 'MSI':
+        b_data += np.float32(1e-10)  # Add small number to avoid division by zero
+        a_data /= b_data
+        result = a_data
+    elif index_name == 'AVI':
+        if NUMEXPR_AVAILABLE:
+            result = ne.evaluate('((a + 1) * (1 - (b + 1) / 10000) * (a - b)) ** (1.0 / 3)',
+                                 local_dict={'a': a_data, 'b': b_data})
+        else:
+            result = a_data - b_data
+            a_data += 1
+            b_data += 1
+            b_data /= np.float32(-10000.0)
+            b_data += 1
+            result *= a_data
+            result *= b_data
+            negative = result < 0
+            np.cbrt(result, out=result)
+            result[negative] = np.nan  # Keep the fractional power's NaN for negative values
+    elif index_name == 'SAVI':
+        result = a_data - b_data
+        a_data += b_data
+        a_data += np.float32(0.5)
+        result /= a_data
+        result *= np.float32(1.5)
+
+    return result
 
 class SatelliteIndexCalculatorAlgorithm(QgsProcessingAlgorithm):
     SATELLITE_TYPE = 'SATELLITE_TYPE'
@@ -18,13 +84,13 @@ class SatelliteIndexCalculatorAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterEnum(
             self.SATELLITE_TYPE,
             self.tr('Satellite type'),
-            options=['Sentinel-2', 'Landsat-7', 'Landsat-8/9'],
+            options=list(_SATELLITE_NAMES),
             defaultValue=0
         ))
         self.addParameter(QgsProcessingParameterEnum(
             self.INDEX_TYPE,
             self.tr('Index type'),
-            options=['NDVI', 'NDWI', 'NDBI', 'NDMI', 'MSI', 'NBR', 'AVI', 'SAVI'],
+            options=list(_INDEX_NAMES),
             defaultValue=0
         ))
         self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT_BAND_HIGHER, self.tr('Higher number band')))
@@ -39,46 +105,10 @@ class SatelliteIndexCalculatorAlgorithm(QgsProcessingAlgorithm):
         band_lower = self.parameterAsRasterLayer(parameters, self.INPUT_BAND_LOWER, context)
         output_raster = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
 
-        index_info = {
-            'Sentinel-2': {
-                'NDVI': {'bands': ('8', '4')},
-                'NDWI': {'bands': ('8', '3')},
-                'NDBI': {'bands': ('11', '8')},
-                'NDMI': {'bands': ('8', '11')},
-                'MSI': {'bands': ('11', '8')},
-                'NBR': {'bands': ('8', '12')},
-                'AVI': {'bands': ('8', '4')},
-                'SAVI': {'bands': ('8', '4')}
-            },
-            'Landsat-7': {
-                'NDVI': {'bands': ('4', '3')},
-                'NDWI': {'bands': ('4', '2')},
-                'NDBI': {'bands': ('5', '4')},
-                'NDMI': {'bands': ('4', '5')},
-                'MSI': {'bands': ('5', '4')},
-                'NBR': {'bands': ('4', '7')},
-                'AVI': {'bands': ('4', '3')},
-                'SAVI': {'bands': ('4', '3')}
-            },
-            'Landsat-8/9': {
-                'NDVI': {'bands': ('5', '4')},
-                'NDWI': {'bands': ('5', '3')},
-                'NDBI': {'bands': ('6', '5')},
-                'NDMI': {'bands': ('5', '6')},
-                'MSI': {'bands': ('6', '5')},
-                'NBR': {'bands': ('5', '7')},
-                'AVI': {'bands': ('5', '4')},
-                'SAVI': {'bands': ('5', '4')}
-            }
-        }
-
-        satellite_names = ['Sentinel-2', 'Landsat-7', 'Landsat-8/9']
-        index_names = ['NDVI', 'NDWI', 'NDBI', 'NDMI', 'MSI', 'NBR', 'AVI', 'SAVI']
-        
-        selected_satellite = satellite_names[satellite_type]
-        selected_index = index_names[index_type]
-        
-        required_bands = index_info[selected_satellite][selected_index]['bands']
+        selected_satellite = _SATELLITE_NAMES[satellite_type]
+        selected_index = _INDEX_NAMES[index_type]
+
+        required_bands = _BAND_TABLE[satellite_type][index_type]
 
         warning_message = f"Calculating {selected_index} for {selected_satellite}:\n"
         warning_message += f"Higher number band should be: Band {max(required_bands)}\n"
@@ -102,40 +132,47 @@ class SatelliteIndexCalculatorAlgorithm(QgsProcessingAlgorithm):
                 raise QgsProcessingException("Input bands have different resolutions. Please use bands with matching resolutions.")
 
             band_a = ds_higher.GetRasterBand(1)
-            band_b = ds_lower.GetRasterBand(1)
 
             # Get raster dimensions
             width = band_a.XSize
             height = band_a.YSize
 
+            # Stack both inputs in a single VRT so every chunk read is aligned across the two bands
+            vrt_xml = stack_bands_vrt([band_higher.source(), band_lower.source()], width, height)
+
             # Create output raster
             driver = gdal.GetDriverByName('GTiff')
-            outds = driver.Create(output_raster, width, height, 1, gdal.GDT_Float32)
+            outds = driver.Create(output_raster, width, height, 1, gdal.GDT_Float32,
+                                  options=['TILED=YES', 'BIGTIFF=IF_SAFER', 'COMPRESS=DEFLATE',
+                                           'PREDICTOR=3', 'NUM_THREADS=ALL_CPUS'])
             outds.SetGeoTransform(ds_higher.GetGeoTransform())
             outds.SetProjection(ds_higher.GetProjection())
             outband = outds.GetRasterBand(1)
 
-            # Process data in chunks to reduce memory usage
-            chunk_size = 1024
-            for y in range(0, height, chunk_size):
-                if feedback.isCanceled():
-                    break
-                win_height = min(chunk_size, height - y)
-                feedback.setProgress(int((y / height) * 100))
-
-                a_data = band_a.ReadAsArray(0, y, width, win_height).astype(float)
-                b_data = band_b.ReadAsArray(0, y, width, win_height).astype(float)
-
-                if selected_index in ['NDVI', 'NDWI', 'NDBI', 'NDMI', 'NBR']:
-                    result = (a_data - b_data) / (a_data + b_data + 1e-10)  # Add small number to avoid division by zero
-                elif selected_index == 'MSI':
-                    result = a_data / (b_data + 1e-10)  # Add small number to avoid division by zero
-                elif selected_index == 'AVI':
-                    result = ((a_data + 1) * (1.0 - (b_data + 1) / 10000.0) * (a_data - b_data)) ** (1/3)
-                elif selected_index == 'SAVI':
-                    result = 1.5 * (a_data - b_data) / (a_data + b_data + 0.5)
-
-                outband.WriteArray(result, 0, y)
+            # Process data in chunks to reduce memory usage, aligned to whole rows of the
+            # input's and output's native blocks so no tile is decoded or rewritten twice
+            out_block_height = outband.GetBlockSize()[1]
+            block_height = math.lcm(band_a.GetBlockSize()[1], out_block_height)
+            if block_height > 1024:
+                block_height = out_block_height
+            chunk_size = max(1, 1024 // block_height) * block_height
+
+            def open_worker():
+                # Each worker reads through its own VRT handle
+                worker_ds = gdal.Open(vrt_xml)
+                worker_band_a = worker_ds.GetRasterBand(1)
+                worker_band_b = worker_ds.GetRasterBand(2)
+                a_buffer = np.empty((chunk_size, width), dtype=np.float32)
+                b_buffer = np.empty((chunk_size, width), dtype=np.float32)
+
+                def compute(y, win_height):
+                    a_data = worker_band_a.ReadAsArray(0, y, width, win_height, buf_obj=a_buffer[:win_height])
+                    b_data = worker_band_b.ReadAsArray(0, y, width, win_height, buf_obj=b_buffer[:win_height])
+                    return calculate_index(selected_index, a_data, b_data)
+                compute.dataset = worker_ds  # keep the handle open for the worker's lifetime
+                return compute
+
+            process_strips(height, chunk_size, open_worker, outband, feedback)
 
             outband.FlushCache()
             outds = None  # Close the dataset
@@ -4,6 +4,7 @@ from qgis.PyQt.QtCore import Qt
 from qgis.core import QgsProject, QgsMapSettings, QgsMapRendererSequentialJob, QgsRasterLayer, QgsCoordinateReferenceSystem
 from qgis.gui import QgsMapCanvas
 from osgeo import gdal, osr
+import numpy as np
 
 class ScreenCaptureDialog(QDialog):
     def __init__(self, iface):
@@ -70,7 +71,8 @@ class ScreenCaptureDialog(QDialog):
         yres = extent.height() / (canvas.height() * zoom)
 
         driver = gdal.GetDriverByName('GTiff')
-        ds = driver.Create(output_file, image.width(), image.height(), 3, gdal.GDT_Byte)
+        ds = driver.Create(output_file, image.width(), image.height(), 3, gdal.GDT_Byte,
+                           options=['TILED=YES', 'COMPRESS=LZW', 'INTERLEAVE=PIXEL', 'NUM_THREADS=ALL_CPUS'])
 
         # Get the current CRS
         crs = canvas.mapSettings().destinationCrs()
@@ -81,14 +83,14 @@ class ScreenCaptureDialog(QDialog):
 
         ds.SetGeoTransform([extent.xMinimum(), xres, 0, extent.yMaximum(), 0, -yres])
 
-        # Convert QImage to byte array and write to dataset
-        byte_array = image.bits().asstring(image.byteCount())
-        for i in range(3):
-            band = ds.GetRasterBand(3-i)  # Reverse order of bands
-            band_array = bytearray(image.width() * image.height())
-            for j in range(0, len(byte_array), 4):
-                band_array[j//4] = byte_array[j+i]
-            band.WriteRaster(0, 0, image.width(), image.height(), bytes(band_array))
+        # View the QImage buffer as (rows, cols, BGRA) and write all three bands in one pixel-interleaved pass
+        width, height = image.width(), image.height()
+        pixels = np.frombuffer(image.bits().asstring(image.byteCount()), dtype=np.uint8)
+        pixels = pixels.reshape(height, image.bytesPerLine())[:, :width * 4]
+        pixels = pixels.reshape(height, width, 4)
+        rgb = np.ascontiguousarray(pixels[:, :, [2, 1, 0]])  # Reverse order of bands
+        ds.WriteRaster(0, 0, width, height, rgb.tobytes(), width, height, gdal.GDT_Byte, [1, 2, 3],
+                       buf_pixel_space=3, buf_line_space=3 * width, buf_band_space=1)
 
         ds = None  # Close the dataset
 
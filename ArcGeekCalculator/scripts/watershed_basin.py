@@ -3,9 +3,19 @@ from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterRasterLayer
                        QgsWkbTypes, QgsField, QgsProcessingUtils, QgsFields, 
                        QgsVectorLayer, QgsProject, QgsFeatureSink, QgsProcessing, QgsFeature,
                        QgsProcessingParameterVectorLayer, QgsProcessingException,
-                       QgsProcessingParameterNumber, QgsRasterLayer)
+                       QgsProcessingParameterNumber, QgsRasterLayer, QgsRectangle,
+                       QgsGeometry, QgsCoordinateTransform, QgsFeatureRequest,
+                       QgsProcessingParameterBoolean, QgsProcessingParameterDefinition)
 from qgis.PyQt.QtCore import QVariant, QCoreApplication
+from osgeo import gdal
+import numpy as np
 import processing
+import hashlib
+import os
+import shutil
+import uuid
+from itertools import islice
+from .watershed_common import create_scratch_folder, fit_dem_to_size
 
 class WatershedBasinDelineationAlgorithm(QgsProcessingAlgorithm):
     INPUT_DEM = 'INPUT_DEM'
@@ -15,28 +25,56 @@ class WatershedBasinDelineationAlgorithm(QgsProcessingAlgorithm):
     OUTPUT_STREAM = 'OUTPUT_STREAM'
     SMOOTH_ITERATIONS = 'SMOOTH_ITERATIONS'
     SMOOTH_OFFSET = 'SMOOTH_OFFSET'
+    SNAP_POUR_POINT = 'SNAP_POUR_POINT'
+    STREAM_CHUNK_SIZE = 'STREAM_CHUNK_SIZE'
     MAX_RASTER_SIZE = 100000000  # 100 million cells, adjust as needed
+    # Intermediate rasters are written tiled so the following steps read whole blocks
+    TILED_OPTIONS = 'TILED=YES|BLOCKXSIZE=512|BLOCKYSIZE=512|COMPRESS=LZW'
+    _drainage_cache = {}  # shared across runs: cache key -> drainage raster path
+    # r.watershed drainage codes 1-8 turn counter-clockwise from north-east, as (row, column) steps
+    DRAINAGE_OFFSETS = {1: (-1, 1), 2: (-1, 0), 3: (-1, -1), 4: (0, -1), 5: (1, -1), 6: (1, 0), 7: (1, 1), 8: (0, 1)}
 
     def initAlgorithm(self, config=None):
         self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT_DEM, 'Input DEM'))
         self.addParameter(QgsProcessingParameterPoint(self.POUR_POINT, 'Pour Point'))
         self.addParameter(QgsProcessingParameterVectorLayer(self.INPUT_STREAM, 'Input Stream Network', 
                                                             types=[QgsProcessing.TypeVectorLine], optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(self.SNAP_POUR_POINT, 'Snap Pour Point to Stream Network', defaultValue=False))
         self.addParameter(QgsProcessingParameterNumber(self.SMOOTH_ITERATIONS, 'Smoothing Iterations', 
                                                        type=QgsProcessingParameterNumber.Integer, 
                                                        minValue=0, maxValue=10, defaultValue=1))
         self.addParameter(QgsProcessingParameterNumber(self.SMOOTH_OFFSET, 'Smoothing Offset', 
                                                        type=QgsProcessingParameterNumber.Double, 
                                                        minValue=0.0, maxValue=0.5, defaultValue=0.25))
+        chunk_size_param = QgsProcessingParameterNumber(self.STREAM_CHUNK_SIZE, 'Stream Features per Chunk', 
+                                                        type=QgsProcessingParameterNumber.Integer, 
+                                                        minValue=1, defaultValue=5000)
+        chunk_size_param.setFlags(chunk_size_param.flags() | QgsProcessingParameterDefinition.FlagAdvanced | QgsProcessingParameterDefinition.FlagHidden)
+        self.addParameter(chunk_size_param)
         self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_BASIN, 'Output Basin', QgsProcessing.TypeVectorPolygon))
         self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_STREAM, 'Output Basin Stream Network', QgsProcessing.TypeVectorLine, optional=True))
 
     def processAlgorithm(self, parameters, context, feedback):
+        dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
+        # Rasters that only pass between two steps go to fast scratch space
+        needed = 3 * 4 * min(dem.width() * dem.height(), self.MAX_RASTER_SIZE) if dem and dem.isValid() else 0
+        self.scratch_folder = create_scratch_folder(needed, 'qgis_wsh_')
+        try:
+            return self.run_pipeline(parameters, context, feedback)
+        finally:
+            shutil.rmtree(self.scratch_folder, ignore_errors=True)
+
+    def scratch_path(self, name, extension):
+        return os.path.join(self.scratch_folder, f'{name}_{uuid.uuid4().hex}.{extension}')
+
+    def run_pipeline(self, parameters, context, feedback):
         dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
         pour_point = self.parameterAsPoint(parameters, self.POUR_POINT, context)
         input_stream = self.parameterAsVectorLayer(parameters, self.INPUT_STREAM, context)
         smooth_iterations = self.parameterAsInt(parameters, self.SMOOTH_ITERATIONS, context)
         smooth_offset = self.parameterAsDouble(parameters, self.SMOOTH_OFFSET, context)
+        snap_pour_point = self.parameterAsBoolean(parameters, self.SNAP_POUR_POINT, context)
+        stream_chunk_size = self.parameterAsInt(parameters, self.STREAM_CHUNK_SIZE, context)
 
         if not dem.isValid():
             raise QgsProcessingException(self.tr('Invalid input DEM'))
@@ -44,127 +82,289 @@ class WatershedBasinDelineationAlgorithm(QgsProcessingAlgorithm):
         if input_stream and input_stream.geometryType() != QgsWkbTypes.LineGeometry:
             raise QgsProcessingException(self.tr('Input Stream Network must be a line layer'))
 
-        # Check and resample DEM if necessary
-        original_cell_size = dem.rasterUnitsPerPixelX()
-        cell_size_multiplier = 1
-        max_attempts = 3
-        
-        for attempt in range(max_attempts):
-            current_cell_size = original_cell_size * cell_size_multiplier
-            resampled_dem = self.resample_dem(dem, current_cell_size, context, feedback)
-            
-            raster_size = resampled_dem.width() * resampled_dem.height()
-            if raster_size <= self.MAX_RASTER_SIZE:
-                if attempt > 0:
-                    feedback.pushInfo(self.tr(f'DEM resampled to {current_cell_size:.2f} units per pixel for processing.'))
+        # Delineate on a window around the pour point, growing it until the basin no longer
+        # reaches an edge of the window that lies inside the DEM
+        dem_extent = dem.extent()
+        cell_size = dem.rasterUnitsPerPixelX()
+        radius = max(dem_extent.width(), dem_extent.height()) / 8
+
+        if input_stream and snap_pour_point:
+            snapped = self.snap_to_stream(pour_point, input_stream, dem.crs(), 3 * cell_size, context)
+            if snapped != pour_point:
+                feedback.pushInfo(self.tr(f'Pour point snapped to the stream network at {snapped.x():.3f}, {snapped.y():.3f}.'))
+                pour_point = snapped
+
+        while True:
+            window = QgsRectangle(pour_point.x() - radius, pour_point.y() - radius,
+                                  pour_point.x() + radius, pour_point.y() + radius).intersect(dem_extent)
+            covers_dem = window.isEmpty() or (window.width() >= dem_extent.width() and window.height() >= dem_extent.height())
+            basin, drainage, basin_raster = self.delineate_basin(dem, None if covers_dem else window, pour_point, context, feedback)
+            if covers_dem:
                 break
-            
-            cell_size_multiplier *= 3
-        
-        if raster_size > self.MAX_RASTER_SIZE:
-            raise QgsProcessingException(self.tr('Input DEM is too large to process efficiently even after resampling. '
-                                                 'Please use a smaller area or lower resolution DEM.'))
-
-        # Step 1: Fill sinks
-        filled_dem = processing.run('grass7:r.fill.dir', {
-            'input': resampled_dem,
-            'format': 0,
-            'output': 'TEMPORARY_OUTPUT',
-            'direction': 'TEMPORARY_OUTPUT',
-            'areas': 'TEMPORARY_OUTPUT'
-        }, context=context, feedback=feedback)['output']
-
-        # Step 2: Calculate flow direction and accumulation
-        watershed_result = processing.run('grass7:r.watershed', {
-            'elevation': filled_dem,
-            'convergence': 5,
-            'memory': 300,
-            '-s': True,
-            'accumulation': 'TEMPORARY_OUTPUT',
-            'drainage': 'TEMPORARY_OUTPUT'
-        }, context=context, feedback=feedback)
-        
-        drainage = watershed_result['drainage']
 
-        # Step 3: Delineate watershed
-        pour_point_str = f'{pour_point.x()},{pour_point.y()}'
-        basin_raster = processing.run('grass7:r.water.outlet', {
-            'input': drainage,
-            'coordinates': pour_point_str,
-            'output': 'TEMPORARY_OUTPUT'
-        }, context=context, feedback=feedback)['output']
-
-        # Step 4: Convert raster basin to vector
-        basin_vector = processing.run('grass7:r.to.vect', {
-            'input': basin_raster,
-            'type': 2,  # area
-            'column': 'value',
-            '-s': True,
-            'output': 'TEMPORARY_OUTPUT',
-            'GRASS_OUTPUT_TYPE_PARAMETER': 3  # auto
-        }, context=context, feedback=feedback)['output']
-
-        # Step 5: Apply smoothing to the basin
-        smoothed_basin = processing.run('native:smoothgeometry', {
-            'INPUT': basin_vector,
-            'ITERATIONS': smooth_iterations,
-            'OFFSET': smooth_offset,
-            'MAX_ANGLE': 180,
-            'OUTPUT': 'memory:'
-        }, context=context, feedback=feedback)['OUTPUT']
-
-        # Load the vector layer
-        basin_layer = smoothed_basin  # smoothed_basin is already a QgsVectorLayer
+            basin_extent = basin.geometry().boundingBox()
+            if basin_extent.isEmpty():
+                break
+            if self.touches_window_edge(basin_extent, window, dem_extent, 2 * cell_size):
+                feedback.pushInfo(self.tr('Basin reaches the edge of the processing window, enlarging it.'))
+            elif self.drains_out_beside_basin(dem, drainage, basin_raster, window, dem_extent):
+                feedback.pushInfo(self.tr('A depression cut by the processing window drains out beside the basin, enlarging it.'))
+            else:
+                break
+            radius *= 2
+
+        if basin.geometry().isEmpty():
+            raise QgsProcessingException(self.tr('Pour point produced an empty basin'))
+
+        # Step 4: Smooth the basin geometry directly while writing it out
+        basin_geom = basin.geometry().smooth(smooth_iterations, smooth_offset, -1, 180)
+        basin.setGeometry(basin_geom)
 
         # Save the basin result
         (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_BASIN, context,
-                                               basin_layer.fields(), QgsWkbTypes.Polygon, basin_layer.crs())
+                                               basin.fields(), QgsWkbTypes.MultiPolygon, dem.crs())
         
         if sink is None:
             raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT_BASIN))
 
-        features = basin_layer.getFeatures()
-        for feature in features:
-            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+        if not basin_geom.isEmpty():
+            sink.addFeature(basin, QgsFeatureSink.FastInsert)
 
         results = {self.OUTPUT_BASIN: dest_id}
 
         # Process input stream network if provided
         if input_stream:
-            clipped_stream = processing.run('native:clip', {
-                'INPUT': input_stream,
-                'OVERLAY': basin_layer,
-                'OUTPUT': 'memory:'
-            }, context=context, feedback=feedback)['OUTPUT']
+            if input_stream.crs() != dem.crs():
+                basin_geom.transform(QgsCoordinateTransform(dem.crs(), input_stream.crs(), context.transformContext()))
 
             # Save the clipped stream result
             (stream_sink, stream_dest_id) = self.parameterAsSink(parameters, self.OUTPUT_STREAM, context,
-                                                                 clipped_stream.fields(), QgsWkbTypes.LineString, clipped_stream.crs())
+                                                                 input_stream.fields(), QgsWkbTypes.MultiLineString, input_stream.crs())
             
             if stream_sink is None:
                 raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT_STREAM))
 
-            stream_features = clipped_stream.getFeatures()
-            for feature in stream_features:
-                stream_sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            # Prepare the basin once and only test streams whose bounding box overlaps it
+            engine = QgsGeometry.createGeometryEngine(basin_geom.constGet())
+            engine.prepareGeometry()
+            request = QgsFeatureRequest().setFilterRect(basin_geom.boundingBox())
+
+            # Clip and write the streams chunk by chunk so peak memory does not grow with the network
+            features = input_stream.getFeatures(request)
+            while not feedback.isCanceled():
+                chunk = list(islice(features, stream_chunk_size))
+                if not chunk:
+                    break
+                clipped = [f for f in (self.clip_to_basin(feature, engine) for feature in chunk) if f is not None]
+                stream_sink.addFeatures(clipped, QgsFeatureSink.FastInsert)
+                stream_sink.flushBuffer()
 
             results[self.OUTPUT_STREAM] = stream_dest_id
 
         return results
 
-    def resample_dem(self, dem, new_cell_size, context, feedback):
-        extent = dem.extent()
-        width = int(extent.width() / new_cell_size)
-        height = int(extent.height() / new_cell_size)
+    def clip_to_basin(self, feature, engine):
+        geom = feature.geometry()
+        if not engine.intersects(geom.constGet()):
+            return None
+        clipped = QgsGeometry(engine.intersection(geom.constGet()))
+        if QgsWkbTypes.flatType(clipped.wkbType()) == QgsWkbTypes.GeometryCollection:
+            clipped = clipped.convertGeometryCollectionToSubclass(QgsWkbTypes.LineGeometry)
+        if clipped.isEmpty() or clipped.type() != QgsWkbTypes.LineGeometry:
+            return None
+        clipped.convertToMultiType()
+        feature.setGeometry(clipped)
+        return feature
+
+    def snap_to_stream(self, pour_point, input_stream, dem_crs, tolerance, context):
+        # Move the pour point onto the nearest stream vertex within the tolerance
+        to_stream = QgsCoordinateTransform(dem_crs, input_stream.crs(), context.transformContext())
+        point = to_stream.transform(pour_point)
+        search = to_stream.transformBoundingBox(QgsRectangle(pour_point.x() - tolerance, pour_point.y() - tolerance,
+                                                             pour_point.x() + tolerance, pour_point.y() + tolerance))
+        request = QgsFeatureRequest().setFilterRect(search).setNoAttributes()
+
+        nearest, nearest_sqr_dist = None, None
+        for feature in input_stream.getFeatures(request):
+            vertex, _, _, _, sqr_dist = feature.geometry().closestVertex(point)
+            if sqr_dist >= 0 and (nearest_sqr_dist is None or sqr_dist < nearest_sqr_dist):
+                nearest, nearest_sqr_dist = vertex, sqr_dist
+
+        if nearest is None:
+            return pour_point
+
+        snapped = to_stream.transform(nearest, QgsCoordinateTransform.ReverseTransform)
+        return snapped if snapped.distance(pour_point) <= tolerance else pour_point
+
+    def drainage_cache_key(self, dem, window):
+        # Identify a drainage computation by the DEM file state and the processing window
+        source = dem.source()
+        stamp = f'{os.path.getmtime(source)}:{os.path.getsize(source)}' if os.path.isfile(source) else ''
+        key = f'{source}|{stamp}|{window.toString(6)}|conv=5 -s'
+        return hashlib.blake2b(key.encode()).hexdigest()
+
+    def delineate_basin(self, dem, window, pour_point, context, feedback):
+        # Drainage only depends on the DEM window, so reuse them across runs
+        cache_key = self.drainage_cache_key(dem, window or dem.extent())
+        drainage = self._drainage_cache.get(cache_key)
+        if drainage and os.path.exists(drainage):
+            feedback.pushInfo(self.tr('Reusing drainage direction computed in a previous run.'))
+        else:
+            drainage = self.compute_drainage(dem, window, context, feedback)
+            self._drainage_cache[cache_key] = drainage
+
+        # Step 2: Delineate watershed
+        pour_point_str = f'{pour_point.x()},{pour_point.y()}'
+        basin_raster = processing.run('grass7:r.water.outlet', {
+            'input': drainage,
+            'coordinates': pour_point_str,
+            'output': self.scratch_path('basin', 'tif'),
+            'GRASS_RASTER_FORMAT_OPT': self.TILED_OPTIONS.replace('|', ',')
+        }, context=context, feedback=feedback, is_child_algorithm=True)['output']
+
+        # Step 3: Convert raster basin to vector with GDAL's scanline polygonizer
+        polygons = processing.run('gdal:polygonize', {
+            'INPUT': basin_raster,
+            'BAND': 1,
+            'FIELD': 'DN',
+            'EIGHT_CONNECTEDNESS': True,
+            'OUTPUT': self.scratch_path('basin_cells', 'gpkg')
+        }, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
+
+        # Merge the basin cells into one feature directly instead of extracting and dissolving them
+        request = QgsFeatureRequest().setFilterExpression('"DN" = 1').setNoAttributes()
+        cells = QgsVectorLayer(polygons, 'polygons', 'ogr').getFeatures(request)
+        basin_geom = QgsGeometry.unaryUnion([f.geometry() for f in cells])
+        basin_geom.convertToMultiType()
+
+        fields = QgsFields()
+        fields.append(QgsField('DN', QVariant.Int))
+        basin = QgsFeature(fields)
+        basin.setGeometry(basin_geom)
+        basin.setAttributes([1])
+
+        return basin, drainage, basin_raster
+
+    def compute_drainage(self, dem, window, context, feedback):
+        if window is not None:
+            dem = self.clip_dem(dem, window, context, feedback)
+
+        dem = fit_dem_to_size(dem, self.MAX_RASTER_SIZE, lambda dem, cell_size:
+                              self.resample_dem(dem, cell_size, context, feedback), feedback)
+
+        # Step 1: Calculate flow direction and accumulation; r.watershed's least-cost search
+        # routes flow through depressions itself, so the DEM does not need a separate sink fill
+        watershed_result = processing.run('grass7:r.watershed', {
+            'elevation': dem,
+            'convergence': 5,
+            'memory': 300,
+            '-s': True,
+            'accumulation': self.scratch_path('accumulation', 'tif'),
+            'drainage': 'TEMPORARY_OUTPUT',  # kept out of the scratch folder, it is cached across runs
+            'GRASS_RASTER_FORMAT_OPT': self.TILED_OPTIONS.replace('|', ',')
+        }, context=context, feedback=feedback, is_child_algorithm=True)
         
+        drainage = watershed_result['drainage']
+
+        return drainage
+
+    def clip_dem(self, dem, window, context, feedback):
+        clipped = processing.run('gdal:cliprasterbyextent', {
+            'INPUT': dem,
+            'PROJWIN': f'{window.xMinimum()},{window.xMaximum()},{window.yMinimum()},{window.yMaximum()} [{dem.crs().authid()}]',
+            'OPTIONS': self.TILED_OPTIONS,
+            'OUTPUT': self.scratch_path('clipped_dem', 'tif')
+        }, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
+
+        return QgsRasterLayer(clipped, 'clipped_dem', 'gdal')
+
+    def touches_window_edge(self, basin_extent, window, dem_extent, margin):
+        # Only window edges inside the DEM can cut the basin off
+        return ((window.xMinimum() > dem_extent.xMinimum() and basin_extent.xMinimum() <= window.xMinimum() + margin) or
+                (window.xMaximum() < dem_extent.xMaximum() and basin_extent.xMaximum() >= window.xMaximum() - margin) or
+                (window.yMinimum() > dem_extent.yMinimum() and basin_extent.yMinimum() <= window.yMinimum() + margin) or
+                (window.yMaximum() < dem_extent.yMaximum() and basin_extent.yMaximum() >= window.yMaximum() - margin))
+
+    def drains_out_beside_basin(self, dem, drainage, basin_raster, window, dem_extent):
+        # Without a sink fill, a depression that the window cuts in two drains out through the window
+        # edge even where the terrain beyond it is higher. Flow that really reaches the basin can then
+        # leave the window instead, and the basin looks complete without touching the edge. Find such
+        # false outlets on the window edges inside the DEM and check whether any cell draining to one
+        # lies right beside the basin.
+        drainage_ds = gdal.Open(drainage)
+        drainage_band = drainage_ds.GetRasterBand(1)
+        codes = drainage_band.ReadAsArray()
+        nodata = drainage_band.GetNoDataValue()
+        if nodata is not None:
+            codes = np.where(codes == nodata, 0, codes)
+        codes = codes.astype(np.int32)
+        rows, cols = codes.shape
+        in_basin = gdal.Open(basin_raster).GetRasterBand(1).ReadAsArray() == 1
+        if in_basin.shape != codes.shape:
+            return True
+
+        # Elevations on the drainage grid plus a one-cell ring around it, outside the window
+        x_min, cell_x, _, y_max, _, cell_y = drainage_ds.GetGeoTransform()
+        cell_y = abs(cell_y)
+        ring_ds = gdal.Warp('', dem.source(), format='MEM', width=cols + 2, height=rows + 2,
+                            outputBounds=(x_min - cell_x, y_max - (rows + 1) * cell_y, x_min + (cols + 1) * cell_x, y_max + cell_y),
+                            resampleAlg='average', outputType=gdal.GDT_Float32, dstNodata=float('nan'))
+        elevation = ring_ds.GetRasterBand(1).ReadAsArray()
+        ring_ds = None
+
+        # A cell on an inner edge only really drains out when a cell beyond it is lower, or has no data
+        can_leave = np.ones((rows, cols), dtype=bool)
+        edges = [(window.yMaximum() < dem_extent.yMaximum(), (0, slice(None)), elevation[0]),
+                 (window.yMinimum() > dem_extent.yMinimum(), (-1, slice(None)), elevation[-1]),
+                 (window.xMinimum() > dem_extent.xMinimum(), (slice(None), 0), elevation[:, 0]),
+                 (window.xMaximum() < dem_extent.xMaximum(), (slice(None), -1), elevation[:, -1])]
+        for inner, cells, beyond in edges:
+            if inner:
+                can_leave[cells] = False
+        for inner, cells, beyond in edges:
+            lowest_beyond = np.fmin(np.fmin(beyond[:-2], beyond[1:-1]), beyond[2:])
+            if inner:
+                can_leave[cells] |= np.isnan(lowest_beyond) | (lowest_beyond < elevation[1:-1, 1:-1][cells])
+            else:
+                can_leave[cells] = True
+        false_outlet = (codes < 0) & ~can_leave
+        if not false_outlet.any():
+            return False
+
+        # Follow every cell to where its flow ends by pointer jumping over the downstream cells
+        row_index, col_index = np.indices((rows, cols))
+        downstream = (row_index * cols + col_index).ravel()
+        for code, (row_step, col_step) in self.DRAINAGE_OFFSETS.items():
+            to_row, to_col = row_index + row_step, col_index + col_step
+            step = (codes == code) & (to_row >= 0) & (to_row < rows) & (to_col >= 0) & (to_col < cols)
+            downstream[step.ravel()] = (to_row * cols + to_col)[step]
+        for _ in range(64):
+            jumped = downstream[downstream]
+            if np.array_equal(jumped, downstream):
+                break
+            downstream = jumped
+        escapes = false_outlet.ravel()[downstream].reshape(rows, cols)
+
+        padded = np.pad(in_basin, 1)
+        beside = np.zeros_like(in_basin)
+        for row_step in (-1, 0, 1):
+            for col_step in (-1, 0, 1):
+                beside |= padded[1 + row_step:1 + row_step + rows, 1 + col_step:1 + col_step + cols]
+        return bool(np.any(escapes & beside & ~in_basin))
+
+    def resample_dem(self, dem, new_cell_size, context, feedback):
+        # Average the cells rather than picking one, so the coarser DEM does not gain artificial pits
         resampled = processing.run("gdal:warpreproject", {
             'INPUT': dem,
             'SOURCE_CRS': dem.crs(),
             'TARGET_CRS': dem.crs(),
-            'RESAMPLING': 0,  # Nearest neighbor
+            'RESAMPLING': 5,  # Average
             'TARGET_RESOLUTION': new_cell_size,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }, context=context, feedback=feedback)['OUTPUT']
+            'MULTITHREADING': True,
+            'OPTIONS': self.TILED_OPTIONS,
+            'EXTRA': '-wo NUM_THREADS=ALL_CPUS',
+            'OUTPUT': self.scratch_path('resampled_dem', 'tif')
+        }, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
         
         return QgsRasterLayer(resampled, 'resampled_dem', 'gdal')
 
@@ -194,6 +394,7 @@ class WatershedBasinDelineationAlgorithm(QgsProcessingAlgorithm):
             Input DEM: A raster layer representing the terrain elevation
             Pour Point: The outlet point of the watershed
             Input Stream Network: Optional. A line vector layer representing the stream network
+            Snap Pour Point to Stream Network: Moves the pour point to the nearest stream vertex within 3 cells
             Smoothing Iterations: Number of iterations for smoothing the basin boundary (0-10)
             Smoothing Offset: Offset value for smoothing (0.0-0.5)
         
@@ -202,13 +403,12 @@ class WatershedBasinDelineationAlgorithm(QgsProcessingAlgorithm):
             Output Basin Stream Network: Optional. A line layer representing the clipped stream network within the basin
         
         The algorithm performs the following steps:
-        1. Checks and resamples the DEM if necessary
-        2. Fills sinks in the DEM
-        3. Calculates flow direction and accumulation
-        4. Delineates the watershed based on the pour point
-        5. Converts the raster watershed to a vector polygon
-        6. Applies smoothing to the basin boundary
-        7. Clips the input stream network to the basin boundary (if provided)
+        1. Crops the DEM to a window around the pour point (enlarged until it contains the basin) and resamples it if necessary
+        2. Calculates flow direction and accumulation, routing flow through sinks without filling them
+        3. Delineates the watershed based on the pour point
+        4. Converts the raster watershed to a vector polygon
+        5. Applies smoothing to the basin boundary
+        6. Clips the input stream network to the basin boundary (if provided)
         
         Note: The accuracy of the watershed delineation depends on the resolution and quality of the input DEM.
         """)
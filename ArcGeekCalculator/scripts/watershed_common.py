@@ -0,0 +1,32 @@
+import math
+import os
+import shutil
+import tempfile
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import QgsProcessingException, QgsProcessingUtils, QgsSettings
+
+def create_scratch_folder(required_bytes, prefix):
+    # Scratch rasters go to the folder set in WATERSHED_TMPDIR, then to RAM-backed /dev/shm
+    # when it has twice the room they need, and otherwise to the processing temp folder
+    configured = QgsSettings().value('Processing/Configuration/WATERSHED_TMPDIR', '')
+    if configured and os.path.isdir(configured):
+        parent = configured
+    elif os.path.isdir('/dev/shm') and shutil.disk_usage('/dev/shm').free > 2 * required_bytes:
+        parent = '/dev/shm'
+    else:
+        parent = QgsProcessingUtils.tempFolder()
+    return tempfile.mkdtemp(prefix=prefix, dir=parent)
+
+def fit_dem_to_size(dem, max_cells, resample, feedback):
+    # Keep the native resolution whenever the DEM fits; otherwise coarsen it just enough, in one step.
+    # resample(dem, cell_size) is the tool's own resampling step and returns the new raster layer.
+    if dem.width() * dem.height() <= max_cells:
+        return dem
+    extent = dem.extent()
+    new_cell_size = math.sqrt(extent.width() * extent.height() / max_cells) * 1.01
+    resampled = resample(dem, new_cell_size)
+    if resampled.width() * resampled.height() > max_cells:
+        raise QgsProcessingException(QCoreApplication.translate('Processing', 'Input DEM is too large to process efficiently even after resampling. '
+                                                                'Please use a smaller area or lower resolution DEM.'))
+    feedback.pushInfo(QCoreApplication.translate('Processing', f'DEM resampled to {new_cell_size:.2f} units per pixel for processing.'))
+    return resampled
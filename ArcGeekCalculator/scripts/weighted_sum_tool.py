@@ -1,13 +1,81 @@
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (QgsProcessing, QgsProcessingAlgorithm, QgsProcessingParameterMultipleLayers,
                        QgsProcessingParameterString, QgsProcessingParameterRasterDestination, 
-                       QgsProcessingException, QgsRasterLayer)
-from qgis.analysis import QgsRasterCalculator, QgsRasterCalculatorEntry
+                       QgsProcessingException, QgsRasterLayer, QgsProcessingParameterBoolean,
+                       QgsProcessingParameterDefinition, QgsProcessingOutputLayerDefinition)
+from osgeo import gdal, osr
+import numpy as np
+from functools import lru_cache
+from math import fsum
+import uuid
+from .raster_strips import process_strips, strip_worker_count
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# Same nodata value QgsRasterCalculator used for its output
+OUTPUT_NODATA = float(np.finfo(np.float32).min)
+
+# Tiled, compressed output; the floating point predictor helps DEFLATE on smooth surfaces
+CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'COMPRESS=DEFLATE',
+                    'PREDICTOR=3', 'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER']
+
+# Example weights shown in validation messages for the usual raster counts
+_EXAMPLE_WEIGHTS = {
+    2: "50,50",
+    3: "30,30,40",
+    4: "25,25,25,25",
+    5: "20,20,20,20,20",
+    6: "16,16,17,17,17,17",
+    7: "15,15,14,14,14,14,14",
+    8: "13,13,13,13,12,12,12,12",
+    9: "12,11,11,11,11,11,11,11,11",
+    10: "10,10,10,10,10,10,10,10,10,10",
+}
+
+def strip_memory_budget():
+    # 40% of the free memory for the strips being combined, or a fixed 512 MB without psutil
+    if PSUTIL_AVAILABLE:
+        return int(psutil.virtual_memory().available * 0.4)
+    return 512 * 1024 ** 2
+
+def unlink_with_layer(project, path):
+    # Free an in-memory output once the project layer reading it is removed, or the project is cleared
+    def release(layer_id=None):
+        if layer_id is not None:
+            layer = project.mapLayer(layer_id)
+            if layer is None or layer.source() != path:
+                return
+        gdal.Unlink(path)
+        project.layerWillBeRemoved[str].disconnect(release)
+        project.cleared.disconnect(release)
+
+    project.layerWillBeRemoved[str].connect(release)
+    project.cleared.connect(release)
+
+@lru_cache(maxsize=32)
+def parse_weights(weights_str):
+    # Validation and processing parse the same string, on different algorithm instances
+    return tuple(float(w.strip()) for w in weights_str.split(',') if w.strip())
+
+@lru_cache(maxsize=None)
+def _build_example_weights(num_rasters):
+    base_weight = int(100 / num_rasters)
+    remainder = 100 - (base_weight * num_rasters)
+    weights = [base_weight] * num_rasters
+    for i in range(remainder):
+        weights[i] += 1
+    return ",".join(map(str, weights))
 
 class WeightedSumTool(QgsProcessingAlgorithm):
     INPUT_RASTERS = 'INPUT_RASTERS'
     WEIGHTS = 'WEIGHTS'
     OUTPUT_WEIGHTED_SUM = 'OUTPUT_WEIGHTED_SUM'  # Changed from OUTPUT to OUTPUT_WEIGHTED_SUM
+    MEMORY_ONLY = 'MEMORY_ONLY'
+    MEMORY_WARNING_BYTES = 2 * 1024 ** 3  # in-memory outputs above this size get a warning
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -30,6 +98,10 @@ class WeightedSumTool(QgsProcessingAlgorithm):
                 self.tr('Output Weighted Sum Raster')  # Changed description to be more descriptive
             )
         )
+        memory_only_param = QgsProcessingParameterBoolean(self.MEMORY_ONLY, self.tr('Keep Output in Memory (/vsimem)'),
+                                                          defaultValue=False)
+        memory_only_param.setFlags(memory_only_param.flags() | QgsProcessingParameterDefinition.FlagAdvanced | QgsProcessingParameterDefinition.FlagHidden)
+        self.addParameter(memory_only_param)
 
     def checkParameterValues(self, parameters, context):
         raster_layers = self.parameterAsLayerList(parameters, self.INPUT_RASTERS, context)
@@ -42,7 +114,7 @@ class WeightedSumTool(QgsProcessingAlgorithm):
         example_weights = self.get_example_weights(num_rasters)
 
         try:
-            weights = [float(w.strip()) for w in weights_str.split(',') if w.strip()]
+            weights = parse_weights(weights_str)
         except ValueError:
             return False, self.tr(f'Invalid weight values. Please enter {num_rasters} numeric values separated by commas. '
                                   f'For example: {example_weights}')
@@ -51,7 +123,7 @@ class WeightedSumTool(QgsProcessingAlgorithm):
             return False, self.tr(f'Number of weights ({len(weights)}) does not match number of input rasters ({num_rasters}). '
                                   f'Please enter {num_rasters} weights. For example: {example_weights}')
 
-        weight_sum = sum(weights)
+        weight_sum = fsum(weights)
         if abs(weight_sum - 100) > 0.001:
             return False, self.tr(f'Weights sum to {weight_sum:.2f}, but they must sum to 100. '
                                   f'Please adjust your weights. For example: {example_weights}')
@@ -59,57 +131,175 @@ class WeightedSumTool(QgsProcessingAlgorithm):
         return super().checkParameterValues(parameters, context)
 
     def get_example_weights(self, num_rasters):
-        if num_rasters == 2:
-            return "50,50"
-        elif num_rasters == 3:
-            return "30,30,40"
-        elif num_rasters == 4:
-            return "25,25,25,25"
-        elif num_rasters == 5:
-            return "20,20,20,20,20"
-        elif num_rasters == 6:
-            return "16,16,17,17,17,17"
-        else:
-            base_weight = int(100 / num_rasters)
-            remainder = 100 - (base_weight * num_rasters)
-            weights = [base_weight] * num_rasters
-            for i in range(remainder):
-                weights[i] += 1
-            return ",".join(map(str, weights))
+        return _EXAMPLE_WEIGHTS.get(num_rasters) or _build_example_weights(num_rasters)
 
     def processAlgorithm(self, parameters, context, feedback):
         raster_layers = self.parameterAsLayerList(parameters, self.INPUT_RASTERS, context)
         weights_str = self.parameterAsString(parameters, self.WEIGHTS, context)
         output = self.parameterAsOutputLayer(parameters, self.OUTPUT_WEIGHTED_SUM, context)  # Changed from OUTPUT to OUTPUT_WEIGHTED_SUM
+        memory_only = self.parameterAsBoolean(parameters, self.MEMORY_ONLY, context)
+        self.memory_output = None
 
-        weights = [float(w.strip()) for w in weights_str.split(',') if w.strip()]
+        # Scripted pipelines can keep a temporary result in GDAL's in-memory filesystem. A file the
+        # user picked is always written; otherwise the /vsimem path replaces the temporary file
+        # QGIS registered to load on completion.
+        if memory_only:
+            destination = parameters.get(self.OUTPUT_WEIGHTED_SUM)
+            if isinstance(destination, QgsProcessingOutputLayerDefinition):
+                destination = destination.sink.staticValue()
+            if destination != QgsProcessing.TEMPORARY_OUTPUT:
+                feedback.pushWarning(self.tr('Keep Output in Memory only applies to temporary outputs; '
+                                             f'writing to {output}.'))
+                memory_only = False
+
+        if memory_only:
+            temporary_file = output
+            output = f'/vsimem/weighted_sum_{uuid.uuid4().hex}.tif'
+            layers_to_load = context.layersToLoadOnCompletion()
+            details = layers_to_load.pop(temporary_file, None)
+            if details is not None:
+                layers_to_load[output] = details
+                context.setLayersToLoadOnCompletion(layers_to_load)
+                self.memory_output = output
+            else:
+                feedback.pushWarning(self.tr(f'The output is kept in memory at {output} and is not loaded into a project; '
+                                             f'it uses RAM until the caller runs gdal.Unlink("{output}").'))
+
+        weights = parse_weights(weights_str)
 
         # Normalize weights to sum to 1
         weights = [w / 100 for w in weights]
 
-        # Create raster calculator entries
-        entries = []
-        for i, raster in enumerate(raster_layers):
-            entry = QgsRasterCalculatorEntry()
-            entry.ref = f'ras{i}@1'
-            entry.raster = raster
-            entry.bandNumber = 1
-            entries.append(entry)
+        # A single raster is its own weighted sum, so just copy band 1.
+        # gdal.Translate does not remap nodata pixels, so only when none need remapping.
+        if len(raster_layers) == 1 and weights[0] == 1:
+            source_nodata = gdal.Open(raster_layers[0].source()).GetRasterBand(1).GetNoDataValue()
+            if source_nodata is None or np.float32(source_nodata) == np.float32(OUTPUT_NODATA):
+                feedback.pushInfo(self.tr('Only one raster has a weight; copying it to the output.'))
+                gdal.Translate(output, raster_layers[0].source(), format='GTiff', bandList=[1],
+                               outputType=gdal.GDT_Float32, noData=OUTPUT_NODATA, creationOptions=CREATION_OPTIONS)
+                feedback.setProgress(100)
+                return {self.OUTPUT_WEIGHTED_SUM: output}
+
+        datasets = [gdal.Open(raster.source()) for raster in raster_layers]
+        reference = datasets[0]
+        width = reference.RasterXSize
+        height = reference.RasterYSize
+        geotransform = reference.GetGeoTransform()
+        projection = reference.GetProjection()
+        if any(ds.RasterXSize != width or ds.RasterYSize != height for ds in datasets):
+            raise QgsProcessingException(self.tr('All input rasters must have the same number of rows and columns.'))
 
-        # Construct formula
-        formula = ' + '.join([f'({entry.ref} * {w})' for entry, w in zip(entries, weights)])
+        # Pixels are combined by position, so the grids must also cover the same ground
+        tolerance = 1e-6 * max(abs(geotransform[1]), abs(geotransform[5]))
+        reference_srs = osr.SpatialReference(wkt=projection) if projection else None
+        for raster, ds in zip(raster_layers[1:], datasets[1:]):
+            if any(abs(a - b) > tolerance for a, b in zip(ds.GetGeoTransform(), geotransform)):
+                raise QgsProcessingException(self.tr(f'Raster "{raster.name()}" does not share the extent and resolution '
+                                                     f'of "{raster_layers[0].name()}".'))
+            other_projection = ds.GetProjection()
+            if reference_srs and other_projection and not reference_srs.IsSame(osr.SpatialReference(wkt=other_projection)):
+                raise QgsProcessingException(self.tr(f'Raster "{raster.name()}" is not in the same CRS '
+                                                     f'as "{raster_layers[0].name()}".'))
+        if memory_only and width * height * np.dtype(np.float32).itemsize > self.MEMORY_WARNING_BYTES:
+            feedback.pushWarning(self.tr(f'The in-memory output needs about {width * height * 4 / 1024 ** 3:.1f} GB of RAM '
+                                         f'before compression; write to a file if memory runs short.'))
 
-        # Create and execute raster calculator
-        calc = QgsRasterCalculator(formula, output, 'GTiff', 
-                                   raster_layers[0].extent(), raster_layers[0].width(), raster_layers[0].height(), 
-                                   entries)
-        result = calc.processCalculation(feedback)
+        bands = [ds.GetRasterBand(1) for ds in datasets]
+        nodata_values = [None if nodata is None else np.float32(nodata)
+                         for nodata in (band.GetNoDataValue() for band in bands)]
 
-        if result != 0:
-            raise QgsProcessingException(self.tr(f'Error calculating output raster: {result}'))
+        # A raster with a weight of 0 does not change the sum, so only its nodata mask is read
+        active = [i for i, w in enumerate(weights) if w != 0]
+        masked = [i for i, w in enumerate(weights) if w == 0 and nodata_values[i] is not None]
+        if len(active) < len(raster_layers):
+            feedback.pushInfo(self.tr(f'{len(raster_layers) - len(active)} raster(s) with a weight of 0 '
+                                      f'only contribute their nodata pixels.'))
+
+        # Create output raster
+        driver = gdal.GetDriverByName('GTiff')
+        outds = driver.Create(output, width, height, 1, gdal.GDT_Float32, options=CREATION_OPTIONS)
+        outds.SetGeoTransform(geotransform)
+        outds.SetProjection(projection)
+        outband = outds.GetRasterBand(1)
+        outband.SetNoDataValue(OUTPUT_NODATA)
+
+        # Combine the rasters a strip of whole input blocks at a time instead of per pixel.
+        # Strips are as tall as the memory budget allows for every worker's stack and result,
+        # but no taller than needed to give each worker a share of the rows.
+        block_height = bands[active[0]].GetBlockSize()[1]
+        max_workers = strip_worker_count()
+        row_bytes = width * (np.dtype(np.float32).itemsize * (len(active) + 1) + len(masked))
+        budget_rows = strip_memory_budget() // (max_workers * row_bytes)
+        rows_per_worker = -(-height // max_workers)
+        chunk_size = max(block_height, min(budget_rows, rows_per_worker) // block_height * block_height)
+
+        active_weights = np.asarray([weights[i] for i in active], dtype=np.float32)
+        active_nodata = [nodata_values[i] for i in active]
+        sources = [raster.source() for raster in raster_layers]
+
+        def open_worker():
+            # Each worker reads through its own handles
+            worker_datasets = {i: gdal.Open(sources[i]) for i in active + masked}
+            worker_bands = [worker_datasets[i].GetRasterBand(1) for i in active]
+            mask_bands = [worker_datasets[i].GetRasterBand(1).GetMaskBand() for i in masked]
+
+            # One rasters x pixels buffer, so each strip is a single matrix-vector product
+            stack = np.empty((len(worker_bands), chunk_size * width), dtype=np.float32)
+            result_buffer = np.empty(chunk_size * width, dtype=np.float32)
+            mask_buffer = np.empty(chunk_size * width, dtype=np.uint8) if mask_bands else None
+
+            def compute(y, win_height):
+                pixels = win_height * width
+
+                # Read straight into the float32 stack rows, so no strip allocates new arrays
+                for i, band in enumerate(worker_bands):
+                    band.ReadAsArray(0, y, width, win_height, buf_obj=stack[i, :pixels].reshape(win_height, width))
+                result = np.matmul(active_weights, stack[:, :pixels], out=result_buffer[:pixels])
+
+                # A pixel is nodata in the output if it is nodata in any input, weighted or not
+                for values, nodata in zip(stack[:, :pixels], active_nodata):
+                    if nodata is not None:
+                        result[values == nodata] = OUTPUT_NODATA
+                for band in mask_bands:
+                    band.ReadAsArray(0, y, width, win_height, buf_obj=mask_buffer[:pixels].reshape(win_height, width))
+                    result[mask_buffer[:pixels] == 0] = OUTPUT_NODATA
+                return result.reshape(win_height, width)
+            compute.datasets = worker_datasets  # keep the handles open for the worker's lifetime
+            return compute
+
+        # Let GDAL decompress the tiles of each read on all cores, and keep more of them cached
+        previous_num_threads = gdal.GetConfigOption('GDAL_NUM_THREADS')
+        previous_cache_max = gdal.GetCacheMax()
+        gdal.SetConfigOption('GDAL_NUM_THREADS', 'ALL_CPUS')
+        gdal.SetCacheMax(max(previous_cache_max, 512 << 20))
+        try:
+            process_strips(height, chunk_size, open_worker, outband, feedback)
+        except Exception:
+            if memory_only:
+                outband = outds = None
+                self.memory_output = None
+                gdal.Unlink(output)
+            raise
+        finally:
+            gdal.SetConfigOption('GDAL_NUM_THREADS', previous_num_threads)
+            gdal.SetCacheMax(previous_cache_max)
+
+        outband.FlushCache()
+        outds = None  # Close the dataset
 
         return {self.OUTPUT_WEIGHTED_SUM: output}  # Changed from OUTPUT to OUTPUT_WEIGHTED_SUM
 
+    def postProcessAlgorithm(self, context, feedback):
+        # Runs on the main thread once the run is done: the loaded layer owns the in-memory output
+        memory_output = getattr(self, 'memory_output', None)
+        if memory_output and context.willLoadLayerOnCompletion(memory_output):
+            project = context.layerToLoadOnCompletionDetails(memory_output).project or context.project()
+            if project is not None:
+                unlink_with_layer(project, memory_output)
+        self.memory_output = None
+        return {}
+
     def name(self):
         return 'weightedsum'
 